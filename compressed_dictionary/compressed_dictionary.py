@@ -1,21 +1,301 @@
 import os
 import sys
+import base64
 import math
+import mmap
 import lzma
 import bz2
-import gzip
+import zlib
 import random
-from collections.abc import MutableMapping
-from struct import pack, unpack
+import shutil
+import threading
+from collections.abc import Mapping, MutableMapping
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import chain, islice
+from struct import Struct
 
 import json
-from typing import Dict, List, Union
+from typing import Any, Dict, Iterable, List, Tuple, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# `ujson` is only a fallback, do not pay for its import if `orjson` is available
+ujson = None
+if orjson is None:
+    try:
+        import ujson
+    except ImportError:
+        pass
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# memory used by an empty `bytes` object
+_BYTES_HEADER_SIZE = sys.getsizeof(b'')
+
+# Values are serialized with the fastest json library available and marked by a leading tag that cannot start
+# a json document. Untagged values are decoded with the standard library: they were either written by older
+# versions or rejected by the fast encoders (e.g. integers wider than 64 bits, lone surrogates or `NaN`),
+# and the fast decoders would not read them back unchanged (e.g. `orjson` reads big integers as floats).
+_JSON_TAG = b'\x04'
+
+
+def _json_dumps_fallback(value) -> bytes:
+    return json.dumps(value).encode('utf-8')
+
+
+def _json_loads_fallback(data: bytes):
+    return json.loads(data)
+
+
+# types serialized in the same way by the standard library and by the fast json libraries
+_JSON_SCALAR_TYPES = frozenset((str, int, bool, type(None)))
+_JSON_KEY_TYPES = frozenset((str, int))
+
+
+def _is_plain_json(value) -> bool:
+    r"""
+    Return True if `value` is made only of strings, integers, booleans, `None`, finite floats, lists, tuples
+    and dictionaries with string or integer keys, without subclasses. Other values are serialized by the standard
+    library, which either serializes them differently from the fast json libraries or rejects them.
+    """
+    containers = [(value,)]
+    while containers:
+        for item in containers.pop():
+            item_type = type(item)
+            if item_type in _JSON_SCALAR_TYPES:
+                continue
+            if item_type is float:
+                if not math.isfinite(item):
+                    return False
+            elif item_type is list or item_type is tuple:
+                containers.append(item)
+            elif item_type is dict:
+                if not set(map(type, item)) <= _JSON_KEY_TYPES:
+                    return False
+                containers.append(item.values())
+            else:
+                return False
+    return True
+
+
+if orjson is not None:
+
+    # `orjson` raises on datetimes and dataclasses like the standard library does
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def _json_dumps(value) -> bytes:
+        try:
+            data = orjson.dumps(value, option=_ORJSON_OPTIONS)
+        except TypeError:
+            return _json_dumps_fallback(value)
+        # `orjson` serializes some types that the standard library rejects (e.g. `UUID` or `Enum`) and writes
+        # `NaN` and `Infinity` as `null`: such values are never read back equal. Values that are not equal only
+        # because of tuples or integer keys are checked to be plain json
+        if orjson.loads(data) != value and not _is_plain_json(value):
+            return _json_dumps_fallback(value)
+        return _JSON_TAG + data
+
+    def _json_loads(data: bytes):
+        if data[:1] == _JSON_TAG:
+            return orjson.loads(data[1:])
+        return _json_loads_fallback(data)
+
+elif ujson is not None:
+
+    def _json_dumps(value) -> bytes:
+        # `ujson` serializes some types that the standard library rejects (e.g. `Decimal`) as plain numbers,
+        # so values are checked before serializing them
+        if not _is_plain_json(value):
+            return _json_dumps_fallback(value)
+        try:
+            return _JSON_TAG + ujson.dumps(value, ensure_ascii=False).encode('utf-8')
+        except (OverflowError, UnicodeEncodeError):
+            return _json_dumps_fallback(value)
+
+    def _json_loads(data: bytes):
+        if data[:1] == _JSON_TAG:
+            return ujson.loads(data[1:])
+        return _json_loads_fallback(data)
+
+else:
+
+    _json_dumps = _json_dumps_fallback
+
+    def _json_loads(data: bytes):
+        if data[:1] == _JSON_TAG:
+            return json.loads(data[1:])
+        return _json_loads_fallback(data)
+
+
+# Strings and bytes are not serialized as json. They are marked by a leading tag that cannot start
+# a json document, so that values serialized by older versions are still recognized as json.
+# Values serialized with `msgpack` are tagged as well, so every value can be decoded without knowing
+# the serialization used by the dictionary that contained it.
+_STR_TAG = b'\x01'
+_BYTES_TAG = b'\x02'
+_MSGPACK_TAG = b'\x03'
+
+
+def _msgpack_dumps(value) -> bytes:
+    try:
+        return _MSGPACK_TAG + msgpack.packb(value, use_bin_type=True)
+    except (TypeError, OverflowError, ValueError):
+        return _json_dumps(value) # e.g. integers wider than 64 bits
+
+
+def _msgpack_loads(data: bytes):
+    if msgpack is None:
+        raise ValueError(
+            "value serialized with `msgpack`, which is not installed"
+        )
+    return msgpack.unpackb(data[1:], raw=False, strict_map_key=False)
+
+
+def _serialize(value, dumps=_json_dumps) -> bytes:
+    if isinstance(value, str):
+        return _STR_TAG + value.encode('utf-8', 'surrogatepass')
+    if isinstance(value, (bytes, bytearray)):
+        return _BYTES_TAG + value
+    return dumps(value)
+
+
+# Values of a dictionary usually have all the same type. Serializers specialized for the type of the first value
+# check only that type and fall back to `_serialize` for other values. Being module functions, they are
+# stored on the instance without preventing dictionaries from being pickled.
+def _serialize_str(value, dumps=_json_dumps) -> bytes:
+    if type(value) is str:
+        return _STR_TAG + value.encode('utf-8', 'surrogatepass')
+    return _serialize(value, dumps)
+
+
+def _serialize_bytes(value, dumps=_json_dumps) -> bytes:
+    if type(value) is bytes:
+        return _BYTES_TAG + value
+    return _serialize(value, dumps)
+
+
+def _serialize_container(value, dumps=_json_dumps) -> bytes:
+    if type(value) is dict or type(value) is list:
+        return dumps(value)
+    return _serialize(value, dumps)
+
+
+_SPECIALIZED_SERIALIZERS = {
+    str: _serialize_str, bytes: _serialize_bytes, dict: _serialize_container, list: _serialize_container
+}
+
+
+def _deserialize(data: bytes):
+    tag = data[:1]
+    if tag == _STR_TAG:
+        return data[1:].decode('utf-8', 'surrogatepass')
+    if tag == _BYTES_TAG:
+        return data[1:]
+    if tag == _MSGPACK_TAG:
+        return _msgpack_loads(data)
+    return _json_loads(data)
+
+
+class _GzipCompression:
+    r"""
+    Drop-in replacement of the `gzip` module `compress`/`decompress` functions built on `zlib`.
+    `gzip.decompress` parses every member header in python before inflating, while `zlib` with `wbits=31`
+    reads and checks the whole gzip stream in C. The output is still a valid gzip stream (with a zero `mtime`),
+    so values compressed by either side are interchangeable.
+    """
+
+    WBITS = 31
+
+    def __init__(self, level: int = 9):
+        self.level = level
+
+    def compress(self, data: bytes):
+        # `zlib.compress` accepts `wbits` only from python 3.11
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, self.WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data: bytes):
+        return zlib.decompress(data, self.WBITS)
+
+
+class _ZstdCompression:
+    r"""
+    Expose `zstandard` with the same `compress`/`decompress` interface of the `bz2`, `gzip` and `lzma` modules.
+    Compression contexts are created once for every thread and reused, since they cannot be shared among threads.
+    If `dictionary` is given, values are compressed with that trained dictionary.
+    """
+
+    def __init__(self, level: int = 3, dictionary: bytes = None):
+        self.level = level
+        self.dictionary = dictionary
+        self._dictionary = zstandard.ZstdCompressionDict(dictionary) if dictionary is not None else None
+        self._contexts = threading.local()
+
+    def __reduce__(self):
+        # contexts are bound to the thread that created them, rebuild them after unpickling
+        return (self.__class__, (self.level, self.dictionary))
+
+    def compress(self, data: bytes):
+        try:
+            compressor = self._contexts.compressor
+        except AttributeError:
+            compressor = self._contexts.compressor = zstandard.ZstdCompressor(
+                level=self.level, dict_data=self._dictionary
+            )
+        return compressor.compress(data)
+
+    def decompress(self, data: bytes):
+        try:
+            decompressor = self._contexts.decompressor
+        except AttributeError:
+            decompressor = self._contexts.decompressor = zstandard.ZstdDecompressor(dict_data=self._dictionary)
+        return decompressor.decompress(data)
+
+
+class _KeysSet:
+    r"""
+    Set of integer keys. Non-negative keys smaller than `max_bitmap_key` are stored as bits of a `bytearray`,
+    which uses much less memory than a `set` of `int` objects when keys are dense. Other keys go to a `set`.
+    """
+
+    def __init__(self, max_bitmap_key: int = 1 << 27):
+        self.max_bitmap_key = max_bitmap_key
+        self._bitmap = bytearray()
+        self._others = set()
+
+    def __contains__(self, key: int):
+        if 0 <= key < self.max_bitmap_key:
+            index = key >> 3
+            return index < len(self._bitmap) and bool(self._bitmap[index] & (1 << (key & 7)))
+        return key in self._others
+
+    def add(self, key: int):
+        if 0 <= key < self.max_bitmap_key:
+            index = key >> 3
+            if index >= len(self._bitmap):
+                # grow geometrically to amortize resizes
+                self._bitmap.extend(bytes(max(index + 1, 2 * len(self._bitmap)) - len(self._bitmap)))
+            self._bitmap[index] |= 1 << (key & 7)
+        else:
+            self._others.add(key)
 
 
 class CompressedDictionary(MutableMapping):
     r"""
-    A dictionary where every value is compressed. Values can be dictionaries, lists or strings
-    (in particular values can be something that could be parsed by `json.dumps`).
+    A dictionary where every value is compressed. Values can be dictionaries, lists, strings or bytes
+    (in particular values can be bytes or something that could be parsed by `json.dumps`).
     Contains also primitives to be dumped to file and restored from a file.
 
     This dictionary is multithread-safe and can be easily used with multiple thread calling both get and set.
@@ -27,7 +307,12 @@ class CompressedDictionary(MutableMapping):
     - Decompression of about 10000 entries / second on a laptop. Entries are the one compressed above. 
 
     Args:
-        compression: compression algorithm, one between `xz`, `gzip` and `bz2`. Defaults to `bz2`.
+        compression: compression algorithm, one between `xz`, `gzip`, `bz2` and `zstd` (only if `zstandard` is installed).
+            Defaults to `bz2`.
+        compression_dictionary: a dictionary trained with `train_dictionary`, only for `zstd` compression.
+        serialization: how values that are not strings or bytes are serialized, either `json` or `msgpack`
+            (only if `msgpack` is installed). `msgpack` keeps bytes and non-string keys of nested dictionaries.
+            Defaults to `json`.
 
     Example:
     >>> d = CompressedDictionary()
@@ -38,19 +323,137 @@ class CompressedDictionary(MutableMapping):
     True
     """
 
-    ALLOWED_COMPRESSIONS = { 'xz': lzma, 'gzip': gzip, 'bz2': bz2 }
-    ATTRIBUTES_TO_DUMP = ['compression']
+    ALLOWED_COMPRESSIONS = { 'xz': lzma, 'gzip': _GzipCompression(), 'bz2': bz2 }
+    if zstandard is not None:
+        ALLOWED_COMPRESSIONS['zstd'] = _ZstdCompression()
+    ALLOWED_SERIALIZATIONS = { 'json': _json_dumps }
+    if msgpack is not None:
+        ALLOWED_SERIALIZATIONS['msgpack'] = _msgpack_dumps
+    ATTRIBUTES_TO_DUMP = ['compression', 'compression_dictionary', 'serialization']
     LINE_LENGTH_BYTES = 4
-
-    def __init__(self, compression: str = 'bz2'):
+    WRITE_BUFFER_SIZE = 4 << 20
+    PARALLEL_COMPRESSION_MIN_SIZE = 1 << 10
+    _LENGTH_STRUCT = Struct('<I')
+    _KEY_STRUCT = Struct('<i')
+    # line length followed by the key, at the beginning of every key-value line
+    _KEY_VALUE_HEADER_STRUCT = Struct('<Ii')
+
+    def __init__(self, compression: str = 'bz2', compression_dictionary: bytes = None, serialization: str = 'json'):
         r"""
         Args:
             compression: a string representing the compression algorithm to use on values and for the dump.
+            compression_dictionary: a `zstd` dictionary trained with `train_dictionary` to compress values with.
+            serialization: a string representing the serialization of values that are not strings or bytes.
         """
 
-        self.check_valid_compression(compression)
+        self._compression_dictionary = compression_dictionary
         self.compression = compression
+        self.serialization = serialization
+        # chosen on the first assignment, see `_SPECIALIZED_SERIALIZERS`
+        self._serialize_value = None
+        # compressed values are kept as separate `bytes` objects: indexing a shared buffer with
+        # `(offset, length)` tuples would cost more per entry than the `bytes` header it saves
         self._content = dict()
+        # largest integer key, kept updated to avoid scanning all the keys when merging
+        self._max_key = -1
+
+    @property
+    def compression(self):
+        return self._compression
+
+    @compression.setter
+    def compression(self, compression: str):
+        self.check_valid_compression(compression)
+        self._bind_compression_algorithm(compression, self._compression_dictionary)
+        self._compression = compression
+
+    @property
+    def compression_dictionary(self):
+        return self._compression_dictionary
+
+    @compression_dictionary.setter
+    def compression_dictionary(self, compression_dictionary: bytes):
+        self._bind_compression_algorithm(self._compression, compression_dictionary)
+        self._compression_dictionary = compression_dictionary
+
+    @property
+    def serialization(self):
+        return self._serialization
+
+    @serialization.setter
+    def serialization(self, serialization: str):
+        self._dumps = self.get_serializer(serialization)
+        self._serialization = serialization
+
+    @classmethod
+    def get_serializer(cls, serialization: str):
+        r""" Return the function serializing values that are not strings or bytes with `serialization`. """
+        if not serialization in cls.ALLOWED_SERIALIZATIONS:
+            raise ValueError(
+                f"`serialization` argument not in allowed values: {cls.ALLOWED_SERIALIZATIONS.keys()}"
+            )
+        return cls.ALLOWED_SERIALIZATIONS[serialization]
+
+    def _bind_compression_algorithm(self, compression: str, compression_dictionary: bytes):
+        # bind compression functions once instead of looking them up for every value.
+        # One-shot `decompress` functions already grow their output in separate blocks (CPython >= 3.10,
+        # bpo-41486), so large values do not need a streaming decompressor to avoid buffer reallocations.
+        # `bz2` and `lzma` compressors cannot be reset after `flush`, so one-shot functions are used for them
+        algorithm = self.get_compression_algorithm(compression, compression_dictionary)
+        self._compress = algorithm.compress
+        self._decompress = algorithm.decompress
+
+    @classmethod
+    def get_compression_algorithm(cls, compression: str, compression_dictionary: bytes = None):
+        r"""
+        Return an object with `compress` and `decompress` methods for `compression`, eventually using
+        the trained `compression_dictionary`.
+        """
+        if compression_dictionary is None:
+            return cls.ALLOWED_COMPRESSIONS[compression]
+        if compression != 'zstd':
+            raise ValueError(
+                "`compression_dictionary` can be used only with `zstd` compression"
+            )
+        return _ZstdCompression(dictionary=compression_dictionary)
+
+    def train_dictionary(self, samples: Iterable[Any] = None, dict_size: int = 1 << 16):
+        r"""
+        Train a `zstd` dictionary of `dict_size` bytes on `samples` (defaults to the values already
+        contained) and use it to compress values. A trained dictionary makes the compression of many small
+        and similar values much faster and effective. Values already contained are compressed again.
+        Only available with `zstd` compression.
+        """
+        if self.compression != 'zstd':
+            raise ValueError(
+                "dictionaries can be trained only with `zstd` compression"
+            )
+
+        if samples is None:
+            samples = [self._decompress(value) for value in self._content.values()]
+        else:
+            samples = [_serialize(sample, self._dumps) for sample in samples]
+
+        decompress = self._decompress
+        self.compression_dictionary = zstandard.train_dictionary(dict_size, samples).as_bytes()
+
+        compress = self._compress
+        for key, value in self._content.items():
+            self._content[key] = compress(decompress(value))
+
+    @staticmethod
+    def _encode_specs(specs: Dict):
+        r""" Make specs json serializable. """
+        if specs.get('compression_dictionary') is not None:
+            specs = dict(specs, compression_dictionary=base64.b64encode(specs['compression_dictionary']).decode('ascii'))
+        return specs
+
+    @staticmethod
+    def _decode_specs(specs: Dict):
+        r""" Restore specs from their json serializable version. """
+        if specs.get('compression_dictionary') is not None:
+            specs = dict(specs, compression_dictionary=base64.b64decode(specs['compression_dictionary']))
+        return specs
     
     @classmethod
     def check_valid_compression(cls, compression: str, raise_error: bool = True):
@@ -66,20 +469,25 @@ class CompressedDictionary(MutableMapping):
                 return False
         return True
 
+    @classmethod
+    def encode_line(cls, data: bytes):
+        r""" Create a line composed of a header (data length) and the corresponding payload. """
+        return cls._LENGTH_STRUCT.pack(len(data)) + data
+
+    @classmethod
+    def encode_key_value_line(cls, key, value):
+        r""" Pack together a key-value pair and create a line. """
+        return cls._KEY_VALUE_HEADER_STRUCT.pack(len(value) + cls._KEY_STRUCT.size, key) + value
+
     @classmethod
     def write_line(cls, data: bytes, fd):
         r""" Write a line composed of a header (data length) and the corresponding payload. """
-        payload_length = len(data)
-        payload_length_bytes = cls.int2bytes(payload_length, cls.LINE_LENGTH_BYTES)
-        line = payload_length_bytes + data
-        fd.write(line)
+        fd.write(cls.encode_line(data))
     
     @classmethod
     def write_key_value_line(cls, key, value, fd):
         r""" Pack together a key-value pair and write as line. """
-        header = f"i{len(value)}s"
-        data = pack(header, key, value)
-        cls.write_line(data, fd)
+        fd.write(cls.encode_key_value_line(key, value))
 
     @classmethod
     def read_line(cls, fd):
@@ -88,45 +496,61 @@ class CompressedDictionary(MutableMapping):
         if not bytes_payload_length:
             return None # no more data to read
 
-        payload_length = cls.bytes2int(bytes_payload_length)
+        payload_length = cls._LENGTH_STRUCT.unpack(bytes_payload_length)[0]
         data = fd.read(payload_length)
         return data
 
     @classmethod
     def read_key_value_line(cls, fd):
-        r""" Unpack key and value by reading a line. """
-        line = cls.read_line(fd)
-        if line is None:
+        r"""
+        Unpack key and value by reading a line. Length and key have fixed width,
+        so they are read together and the value is read directly, without slicing the line.
+        """
+        header = fd.read(cls._KEY_VALUE_HEADER_STRUCT.size)
+        if not header:
             return None # no more data to read
 
-        header = f"i{len(line) - cls.LINE_LENGTH_BYTES}s"
-        key, value = unpack(header, line)
-        return (key, value)
+        payload_length, key = cls._KEY_VALUE_HEADER_STRUCT.unpack(header)
+        return (key, fd.read(payload_length - cls._KEY_STRUCT.size))
 
     def dump(self, filepath: str, limit: int = None):
         r"""
         Dump compressed_dictionary to file.
         Start by collecting the attributes that should be saved and then
-        move the whole content of the dictionary to the file, separating
-        key and values with a tab and different entries with a new-line.
-        This is a safe op because json will escape possible tabs and newlines
-        contained in the values of the dictionary.
+        move the whole content of the dictionary to the file. Every line is
+        composed of a header (payload length) and a payload, which is the key
+        followed by the value. Values are written as they are, already compressed,
+        so the file is not compressed again.
         """
 
-        with open(filepath, "wb") as fo:
+        with open(filepath, "wb", buffering=self.WRITE_BUFFER_SIZE) as fo:
             # write arguments
             specs_to_dump = dict()
             for key in self.ATTRIBUTES_TO_DUMP:
                 specs_to_dump[key] = getattr(self, key)
 
-            args = self.str2bytes(json.dumps(specs_to_dump))
+            args = json.dumps(self._encode_specs(specs_to_dump)).encode('utf-8')
             self.write_line(args, fo)
 
-            # write key-value pairs
-            for i, k in enumerate(self.keys()):
-                if limit is not None and i >= limit:
-                    break
-                self.write_key_value_line(k, self._content[k], fo)
+            # write key-value pairs, collecting many of them before every write
+            content = self._content.items()
+            if limit is not None:
+                content = islice(content, limit)
+
+            # bind hot loop attributes to local names
+            pack_header = self._KEY_VALUE_HEADER_STRUCT.pack
+            key_bytes = self._KEY_STRUCT.size
+            write_buffer_size = self.WRITE_BUFFER_SIZE
+
+            # append header and value separately to avoid concatenating them in a temporary object
+            buffer = bytearray()
+            for key, value in content:
+                buffer += pack_header(len(value) + key_bytes, key)
+                buffer += value
+                if len(buffer) >= write_buffer_size:
+                    fo.write(buffer)
+                    buffer.clear()
+            fo.write(buffer)
 
     @classmethod
     def load(cls, filepath: str, limit: int = None):
@@ -144,22 +568,38 @@ class CompressedDictionary(MutableMapping):
 
         res = CompressedDictionary()
 
-        with open(filepath, "rb") as fi:
+        # map the file in memory and parse it in a single pass instead of reading every line separately
+        with open(filepath, "rb") as fi, mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            unpack_length = cls._LENGTH_STRUCT.unpack_from
+            unpack_header = cls._KEY_VALUE_HEADER_STRUCT.unpack_from
+            line_length_bytes = cls.LINE_LENGTH_BYTES
+            header_bytes = cls._KEY_VALUE_HEADER_STRUCT.size
+
             # read and set arguments
-            arguments = json.loads(cls.bytes2str(cls.read_line(fi)))
+            position = line_length_bytes + unpack_length(mm, 0)[0]
+            arguments = cls._decode_specs(json.loads(mm[line_length_bytes:position]))
             for key, value in arguments.items():
                 setattr(res, key, value)
 
-            # read key-value pairs
+            # read key-value pairs, binding hot loop attributes to local names
+            content = res._content
+            end = len(mm)
+
             read_lines = 0
-            while True:
-                line = cls.read_key_value_line(fi)
-                if line is None or (limit is not None and read_lines >= limit):
-                    break
-                key, value = line
-                res._content[key] = value
+            while position < end and (limit is None or read_lines < limit):
+                payload_length, key = unpack_header(mm, position)
+                value_start = position + header_bytes
+                position += line_length_bytes + payload_length
+
+                # slicing the map copies the value straight into a new `bytes` object, which is the only copy.
+                # Values are not kept as `memoryview`s of the map: a view object is larger than most
+                # compressed values and it would keep the file mapped, so that dumping to the same path
+                # (which truncates it) would crash the interpreter when accessing those values
+                content[key] = mm[value_start:position]
                 read_lines += 1
 
+            res._max_key = max(content, default=-1)
+
         return res
 
     @staticmethod
@@ -184,42 +624,125 @@ class CompressedDictionary(MutableMapping):
         return b.decode('utf-8')
 
     @classmethod
-    def __compress__(cls, value, compression: str = 'bz2'):
-        value = json.dumps(value)
-        value = cls.str2bytes(value)
-        value = cls.ALLOWED_COMPRESSIONS[compression].compress(value)
+    def __compress__(
+        cls, value, compression: str = 'bz2', compression_dictionary: bytes = None, serialization: str = 'json'
+    ):
+        value = _serialize(value, cls.get_serializer(serialization))
+        value = cls.get_compression_algorithm(compression, compression_dictionary).compress(value)
         return value
 
     @classmethod
-    def __decompress__(cls, compressed_value, compression: str = 'bz2'):
-        value = cls.ALLOWED_COMPRESSIONS[compression].decompress(compressed_value)
-        value = cls.bytes2str(value)
-        value = json.loads(value)
+    def __decompress__(cls, compressed_value, compression: str = 'bz2', compression_dictionary: bytes = None):
+        value = cls.get_compression_algorithm(compression, compression_dictionary).decompress(compressed_value)
+        value = _deserialize(value)
         return value
 
     def __getitem__(self, key: int):
-        value = self._content[key]
-        value = self.__class__.__decompress__(value, compression=self.compression)
-        return value
+        return _deserialize(self._decompress(self._content[key]))
 
     def __setitem__(self, key: int, value: Union[Dict, List]):
-        value = self.__class__.__compress__(value, compression=self.compression)
-        self._content[key] = value
+        serialize = self._serialize_value
+        if serialize is None:
+            serialize = self._serialize_value = _SPECIALIZED_SERIALIZERS.get(type(value), _serialize)
+        self._content[key] = self._compress(serialize(value, self._dumps))
+        self._update_max_key(key)
+
+    @classmethod
+    def bulk_compress(
+        cls,
+        values: Iterable[Any],
+        compression: str = 'bz2',
+        workers: int = None,
+        compression_dictionary: bytes = None,
+        serialization: str = 'json',
+    ):
+        r"""
+        Serialize and compress many values, returning the list of compressed values in the same order.
+        Compression algorithms release the GIL, so values are compressed in parallel by `workers` threads
+        (defaults to the number of CPUs) without copying them to other processes.
+        Values smaller than `PARALLEL_COMPRESSION_MIN_SIZE` bytes once serialized are compressed in the calling
+        thread, since they would not release the GIL long enough to benefit from it.
+        """
+        compress = cls.get_compression_algorithm(compression, compression_dictionary).compress
+        dumps = cls.get_serializer(serialization)
+        min_size = cls.PARALLEL_COMPRESSION_MIN_SIZE
+
+        results = []
+        serialize = None
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            for value in values:
+                if serialize is None:
+                    serialize = _SPECIALIZED_SERIALIZERS.get(type(value), _serialize)
+                value = serialize(value, dumps)
+                if len(value) < min_size:
+                    results.append(compress(value))
+                else:
+                    results.append(executor.submit(compress, value))
+
+        return [value.result() if isinstance(value, Future) else value for value in results]
+
+    def bulk_set(self, items: Union[Mapping, Iterable[Tuple[int, Any]]], workers: int = None):
+        r"""
+        Assign many key-value pairs at once, compressing values in parallel with `bulk_compress`.
+        """
+        if isinstance(items, Mapping):
+            items = items.items()
+
+        keys, values = [], []
+        for key, value in items:
+            keys.append(key)
+            values.append(value)
+
+        values = self.bulk_compress(
+            values,
+            compression=self.compression,
+            workers=workers,
+            compression_dictionary=self.compression_dictionary,
+            serialization=self.serialization,
+        )
+
+        # assign in the original order
+        for key, value in zip(keys, values):
+            self._content[key] = value
+            self._update_max_key(key)
+
+    def update_parallel(self, other=(), workers: int = None, **kwargs):
+        r"""
+        Same as `update`, but values that have to be compressed are compressed in parallel with `bulk_compress`.
+        """
+        if isinstance(other, CompressedDictionary) and self.compatible(other):
+            self.update(other)
+            other = ()
+        elif not isinstance(other, Mapping) and hasattr(other, "keys"):
+            other = [(key, other[key]) for key in other.keys()]
+        self.bulk_set(other, workers=workers)
+        self.bulk_set(kwargs, workers=workers)
 
     def __add_already_compresses_value__(self, key: int, value: bytes):
         self._content[key] = value
+        self._update_max_key(key)
+
+    def _update_max_key(self, key: int):
+        if isinstance(key, int) and key > self._max_key:
+            self._max_key = key
+
+    def _reset_max_key(self):
+        self._max_key = max((key for key in self._content if isinstance(key, int)), default=-1)
 
     def __get_without_decompress_value__(self, key: int):
         return self._content[key]
     
     @classmethod
-    def _convert_value(cls, value, compression_in: str, compression_out: str):
-        value = cls.__decompress__(value, compression=compression_in)
-        value = cls.__compress__(value, compression=compression_out)
+    def _convert_value(cls, value, algorithm_in, algorithm_out):
+        # serialized values do not depend on the compression, so there is no need to parse them
+        value = algorithm_in.decompress(value)
+        value = algorithm_out.compress(value)
         return value
 
     def __delitem__(self, key: int):
         del self._content[key]
+        if key == self._max_key:
+            self._reset_max_key()
 
     def __iter__(self):
         return iter(self._content)
@@ -227,25 +750,73 @@ class CompressedDictionary(MutableMapping):
     def __len__(self):
         return len(self._content)
 
+    def __contains__(self, key: int):
+        # do not decompress the value like the `Mapping` implementation would do
+        return key in self._content
+
+    def keys(self):
+        return self._content.keys()
+
+    def update(self, other=(), **kwargs):
+        r"""
+        Update the dictionary with the key-value pairs in `other` and in `kwargs`.
+        Values of a `CompressedDictionary` using the same compression are copied without
+        decompressing and compressing them again.
+        """
+        if isinstance(other, CompressedDictionary) and self.compatible(other):
+            self._content.update(other._content)
+            self._max_key = max(self._max_key, other._max_key)
+            other = ()
+        super().update(other, **kwargs)
+
     def __eq__(self, other: object):
         r"""
         Two compressed dictionaries are equal if they contain the same key-value pairs
-        and if they use the same compression algorithm.
+        and if they use the same compression algorithm. Values are decompressed only if
+        their compressed representations differ.
         """
-        return super().__eq__(other) and (self.compression == other.compression)
+        if not isinstance(other, CompressedDictionary):
+            return NotImplemented
+
+        if self.compression != other.compression:
+            return False
+
+        # identical compressed values correspond to identical values if they were compressed in the same way
+        compatible = self.compatible(other)
+        if compatible and self._content == other._content:
+            return True
+
+        if self._content.keys() != other._content.keys():
+            return False
+
+        other_content = other._content
+        return all(
+            (compatible and value == other_content[key]) or self[key] == other[key]
+            for key, value in self._content.items()
+        )
 
     def compatible(self, other: object):
         r"""
-        Return True if this dictionary and `other` use the same compression and could so be merged.
+        Return True if this dictionary and `other` use the same compression (and compression dictionary)
+        and could so be merged.
         """
-        return (self.compression == other.compression)
+        return (self.compression == other.compression) and (self.compression_dictionary == other.compression_dictionary)
 
     @classmethod
-    def combine_on_disk(cls, destination: str, *dictionaries_files, compression: str = None, reset_keys: bool = True):
+    def combine_on_disk(
+        cls,
+        destination: str,
+        *dictionaries_files,
+        compression: str = None,
+        reset_keys: bool = True,
+        skip_duplicate_check: bool = False
+    ):
         r"""
         Combine together multiple dictionary dumps using in a dictionary using `compression` compression.
         If `compression` is None it will use the compression of the first dictionary argument.
         This method will return write to the `destination` file.
+        If `reset_keys` is False, duplicated keys raise an error unless `skip_duplicate_check` is True:
+        in that case dumps using the output compression are copied as they are, without parsing them.
         """
 
         if not dictionaries_files:
@@ -256,51 +827,115 @@ class CompressedDictionary(MutableMapping):
         # read first file to load encoding info
         with open(dictionaries_files[0], "rb") as fi:
             # read arguments
-            arguments = json.loads(cls.bytes2str(cls.read_line(fi)))
+            arguments = json.loads(cls.read_line(fi))
 
-        with open(destination, "wb") as fo:
+        with open(destination, "wb", buffering=cls.WRITE_BUFFER_SIZE) as fo:
             # write arguments
             out_arguments = arguments.copy()
-            if compression is not None:
+            if compression is not None and compression != arguments['compression']:
                 out_arguments['compression'] = compression
+                out_arguments['compression_dictionary'] = None
 
-            cls.write_line(cls.str2bytes(json.dumps(out_arguments)), fo)
+            out_specs = cls._decode_specs(out_arguments)
+            out_algorithm = cls.get_compression_algorithm(
+                out_specs['compression'], out_specs.get('compression_dictionary')
+            )
+
+            cls.write_line(json.dumps(out_arguments).encode('utf-8'), fo)
 
             # write key-value pairs, eventually converting if source and target compression are different
             new_key = 0
-            res_keys = set()
+            res_keys = _KeysSet()
+            buffer = bytearray()
+
+            # bind hot loop attributes to local names
+            unpack_length = cls._LENGTH_STRUCT.unpack_from
+            unpack_header = cls._KEY_VALUE_HEADER_STRUCT.unpack_from
+            pack_header = cls._KEY_VALUE_HEADER_STRUCT.pack
+            line_length_bytes = cls.LINE_LENGTH_BYTES
+            header_bytes = cls._KEY_VALUE_HEADER_STRUCT.size
+            key_bytes = cls._KEY_STRUCT.size
+            write_buffer_size = cls.WRITE_BUFFER_SIZE
 
             for filename in dictionaries_files:
-                # write key-value pairs for each input filename
-                with open(filename, "rb") as fi:
+                # write key-value pairs for each input filename, parsing the file mapped in memory
+                with open(filename, "rb") as fi, mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ) as mm:
                     # read arguments
-                    arguments_2 = json.loads(cls.bytes2str(cls.read_line(fi)))
-
-                    # copy input to output
-                    while True:
-
-                        line = cls.read_key_value_line(fi)
-                        if line is None:
-                            break
-                        key, value = line
-
-                        if arguments_2['compression'] != out_arguments['compression']:
-                            value = cls._convert_value(value, arguments_2['compression'], out_arguments['compression'])
+                    position = line_length_bytes + unpack_length(mm, 0)[0]
+                    arguments_2 = json.loads(mm[line_length_bytes:position])
+                    end = len(mm)
+
+                    # values can be copied as they are if source and target compression are the same
+                    if (
+                        arguments_2['compression'] == out_arguments['compression']
+                        and arguments_2.get('compression_dictionary') == out_arguments.get('compression_dictionary')
+                    ):
+                        if reset_keys:
+                            # overwrite only the key at the beginning of the line
+                            while position < end:
+                                payload_length = unpack_length(mm, position)[0]
+                                value_start = position + header_bytes
+                                position += line_length_bytes + payload_length
+
+                                buffer += pack_header(payload_length, new_key)
+                                buffer += mm[value_start:position]
+                                new_key += 1
+                                if len(buffer) >= write_buffer_size:
+                                    fo.write(buffer)
+                                    buffer.clear()
+                            fo.write(buffer)
+                            buffer.clear()
+                        else:
+                            if not skip_duplicate_check:
+                                # check keys by reading only lines headers
+                                keys_position = position
+                                while keys_position < end:
+                                    payload_length, key = unpack_header(mm, keys_position)
+                                    keys_position += line_length_bytes + payload_length
+                                    if key in res_keys:
+                                        raise ValueError(
+                                            f"duplicated key detected. Either call with `reset_keys=True` or combine dictionaries with no common key"
+                                        )
+                                    res_keys.add(key)
+
+                            # sequentially copy the whole remaining file
+                            fi.seek(position)
+                            shutil.copyfileobj(fi, fo, write_buffer_size)
+                        continue
+
+                    # copy input to output converting values
+                    specs = cls._decode_specs(arguments_2)
+                    algorithm = cls.get_compression_algorithm(specs['compression'], specs.get('compression_dictionary'))
+                    while position < end:
+                        payload_length, key = unpack_header(mm, position)
+                        value_start = position + header_bytes
+                        position += line_length_bytes + payload_length
+
+                        value = cls._convert_value(mm[value_start:position], algorithm, out_algorithm)
 
                         # if keys are shifted, use incrementally generated new key
                         if reset_keys:
-                            cls.write_key_value_line(new_key, value, fo)
+                            buffer += pack_header(len(value) + key_bytes, new_key)
+                            buffer += value
                             new_key += 1
 
                         # assert new key is not already writted to output
                         else:
-                            if key in res_keys:
+                            if not skip_duplicate_check and key in res_keys:
                                 raise ValueError(
                                     f"duplicated key detected. Either call with `reset_keys=True` or combine dictionaries with no common key"
                                 )
-                            cls.write_key_value_line(key, value, fo)
+                            buffer += pack_header(len(value) + key_bytes, key)
+                            buffer += value
                             res_keys.add(key)
 
+                        if len(buffer) >= write_buffer_size:
+                            fo.write(buffer)
+                            buffer.clear()
+
+                    fo.write(buffer)
+                    buffer.clear()
+
     @staticmethod
     def combine(*dictionaries, reset_keys: bool = True):
         r"""
@@ -342,29 +977,24 @@ class CompressedDictionary(MutableMapping):
                 f"`other` must use the same `compression` algorithm as `self`"
             )
 
-        res = CompressedDictionary()
-        new_key = 0
-
-        # add keys from self
-        for key in self.keys():
-            if reset_keys:
-                res.__add_already_compresses_value__(new_key, self.__get_without_decompress_value__(key))
-                new_key += 1
-            else:
-                res.__add_already_compresses_value__(key, self.__get_without_decompress_value__(key))
-
-        # add keys from other
-        for key in other.keys():
-            if reset_keys:
-                res.__add_already_compresses_value__(new_key, other.__get_without_decompress_value__(key))
-                new_key += 1
-            else:
-                if key in res:
-                    raise ValueError(
-                        f"There is a common key {key} between `self` and `other`"
-                    )
-                else:
-                    res.__add_already_compresses_value__(key, other.__get_without_decompress_value__(key))
+        res = CompressedDictionary(
+            compression=self.compression,
+            compression_dictionary=self.compression_dictionary,
+            serialization=self.serialization,
+        )
+
+        if reset_keys:
+            # number values of both dictionaries from 0
+            res._content = dict(enumerate(chain(self._content.values(), other._content.values())))
+            res._max_key = len(res._content) - 1
+        else:
+            common_keys = self._content.keys() & other._content.keys()
+            if common_keys:
+                raise ValueError(
+                    f"There is a common key {next(iter(common_keys))} between `self` and `other`"
+                )
+            res._content = {**self._content, **other._content}
+            res._max_key = max(self._max_key, other._max_key)
 
         return res
 
@@ -384,35 +1014,40 @@ class CompressedDictionary(MutableMapping):
                 f"`other` must use the same `compression` algorithm as `self`"
             )
 
-        # start by filling holes in the keys list
-        free_keys = set(range(max(self.keys()) + 1)) - set(self.keys())
+        # start by filling holes in the keys list, finding them lazily without materializing the whole range
+        next_key = self._max_key + 1
+        content = self._content
+        free_keys = (i for i in range(next_key) if i not in content)
+
+        # a copy of the items is needed only when merging the dictionary with itself
+        other_items = list(other._content.items()) if other is self else other._content.items()
 
-        for key in list(other.keys()):
+        for key, value in other_items:
             if reset_keys:
-                if free_keys:
-                    self.__add_already_compresses_value__(free_keys.pop(), other.__get_without_decompress_value__(key))
-                else:
-                    self.__add_already_compresses_value__(len(self), other.__get_without_decompress_value__(key))
+                new_key = next(free_keys, None)
+                if new_key is None:
+                    new_key = next_key
+                    next_key += 1
+                self.__add_already_compresses_value__(new_key, value)
             else:
-                if key in self:
+                if key in content:
                     raise ValueError(
                         f"There is a common key {key} between `self` and `other`"
                     )
                 else:
-                    self.__add_already_compresses_value__(key, other.__get_without_decompress_value__(key))
+                    self.__add_already_compresses_value__(key, value)
 
     def get_values_size(self): 
         r"""
         Return total values size (compressed).
         Each bytes array has a fixed default memory usage plus 1 byte for each character
         """
-        byte_header_size = sys.getsizeof(bytes())
-        lengths = sum(len(value) for value in self._content.values())
-        return byte_header_size * len(self) + lengths
+        lengths = sum(map(len, self._content.values()))
+        return _BYTES_HEADER_SIZE * len(self) + lengths
 
     def get_keys_size(self): 
         r""" Return total keys size. """
-        return sum(sys.getsizeof(key) for key in self._content.keys())
+        return sum(map(sys.getsizeof, self._content))
 
     def split(
         self,
@@ -463,12 +1098,23 @@ class CompressedDictionary(MutableMapping):
 
         k, m = divmod(len(all_keys), parts)
 
-        split_keys = [all_keys[i * k + min(i, m):(i + 1) * k + min(i + 1, m)] for i in range(parts)]
-        if len(split_keys) > 1 and len(split_keys[0]) > len(split_keys[-1]) and drop_last:
-            split_keys.pop()
-
-        for keys in split_keys:
-            new_compressed_dictionary = CompressedDictionary(compression=self.compression)
-            for i, k in enumerate(keys):
-                new_compressed_dictionary.__add_already_compresses_value__(i if reset_keys else k, self.__get_without_decompress_value__(k))
+        # only the last part may be smaller than the first one, when the keys cannot be divided evenly
+        if parts > 1 and m > 0 and drop_last:
+            parts -= 1
+
+        # slice keys of each part only when it is needed instead of copying all of them at once
+        for part in range(parts):
+            keys = all_keys[part * k + min(part, m):(part + 1) * k + min(part + 1, m)]
+            new_compressed_dictionary = CompressedDictionary(
+                compression=self.compression,
+                compression_dictionary=self.compression_dictionary,
+                serialization=self.serialization,
+            )
+            values = map(self._content.__getitem__, keys)
+            if reset_keys:
+                new_compressed_dictionary._content = dict(enumerate(values))
+                new_compressed_dictionary._max_key = len(keys) - 1
+            else:
+                new_compressed_dictionary._content = dict(zip(keys, values))
+                new_compressed_dictionary._reset_max_key()
             yield new_compressed_dictionary
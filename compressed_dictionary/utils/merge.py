@@ -19,7 +19,10 @@ def main(args):
     )
 
     logging.info("Merging input dictionaries into single file")
-    CompressedDictionary.combine_on_disk(args.output_file, *args.input_files, compression=args.compression, reset_keys=args.reset_keys)
+    CompressedDictionary.combine_on_disk(
+        args.output_file, *args.input_files, compression=args.compression, reset_keys=args.reset_keys,
+        skip_duplicate_check=args.skip_duplicate_check
+    )
     logging.info("Done")
 
 
@@ -34,6 +37,8 @@ if __name__ == '__main__':
                         choices=list(CompressedDictionary.ALLOWED_COMPRESSIONS.keys()) + [None],
                         help="Compression method of output dictionary")
     parser.add_argument('--reset-keys', action="store_true", help="Whether to reset keys")
+    parser.add_argument('--skip-duplicate-check', action="store_true",
+                        help="Do not check for duplicated keys, which allows to copy inputs without parsing them")
 
     args = parser.parse_args()
 
@@ -1,6 +1,8 @@
 import os
 import math
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 from argparse import ArgumentParser
 
@@ -42,11 +44,19 @@ def main(args):
             math.floor(len(dictionary) / args.parts_length) if args.drop_last else math.ceil(len(dictionary) / args.parts_length)
         )
     )
-    for i, split_dict in tqdm(enumerate(splits_iterator), desc="Splitting", total=total):
-        name = f"{os.path.basename(args.input_file).split('.')[0]}-split-{i}"
-        split_dict.dump(
-            os.path.join(args.output_folder, name),
-        )
+    # splits are independent and values are already compressed, so dumps are written concurrently by threads
+    # sharing the loaded dictionary. At most `workers` splits are kept in memory at the same time
+    workers = args.workers or os.cpu_count()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for i, split_dict in tqdm(enumerate(splits_iterator), desc="Splitting", total=total):
+            name = f"{os.path.basename(args.input_file).split('.')[0]}-split-{i}"
+            pending.append(executor.submit(split_dict.dump, os.path.join(args.output_folder, name)))
+            if len(pending) >= workers:
+                pending.popleft().result()
+
+        for future in pending:
+            future.result()
 
     logging.info("Done")
 
@@ -64,6 +74,8 @@ if __name__ == '__main__':
     parser.add_argument('--shuffle', action="store_true", help="Input dictionary to split")
     parser.add_argument('--limit', type=int, default=None, required=False,
                         help="Read only a limited number of key-value pairs from the input dict")
+    parser.add_argument('--workers', type=int, default=None, required=False,
+                        help="Number of splits written to disk at the same time, defaults to the number of CPUs")
 
     args = parser.parse_args()
 
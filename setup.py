@@ -25,6 +25,7 @@ setuptools.setup(
     license='GNU v2',
     packages=setuptools.find_packages(),
     install_requires=['tqdm'],
+    extras_require={'speedups': ['orjson'], 'zstd': ['zstandard'], 'msgpack': ['msgpack']},
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: GNU General Public License v2 (GPLv2)",
@@ -1,8 +1,23 @@
 import os
+import sys
+import bz2
+import gzip
+import enum
+import uuid
+import pickle
+import json
+import math
 import random
 import shutil
+import decimal
+import datetime
+import dataclasses
+import importlib.util
+from collections import OrderedDict
+from unittest import mock
 import pytest
-from compressed_dictionary.compressed_dictionary import CompressedDictionary
+from compressed_dictionary import compressed_dictionary
+from compressed_dictionary.compressed_dictionary import CompressedDictionary, _KeysSet, _JSON_TAG, orjson, ujson
 
 
 def generate_dict(depth=0):
@@ -113,3 +128,369 @@ def test_combination_on_disk(iteration):
     shutil.rmtree("tmp")
 
     assert a == dd
+
+
+# testing combination on disk with keys reset, compression conversion and duplicated keys
+@pytest.mark.parametrize(
+    ["compression"], [
+        [None], ['gzip'],
+    ],
+)
+def test_combination_on_disk_options(compression):
+
+    first = CompressedDictionary()
+    first.update(((i, generate_dict()) for i in range(20)))
+    second = CompressedDictionary(compression='xz')
+    second.update(((i, generate_list()) for i in range(10, 30)))
+
+    os.makedirs("tmp")
+    first.dump(os.path.join("tmp", "first"))
+    second.dump(os.path.join("tmp", "second"))
+    filepaths = [os.path.join("tmp", "first"), os.path.join("tmp", "second")]
+
+    CompressedDictionary.combine_on_disk(
+        os.path.join("tmp", "result"), *filepaths, compression=compression, reset_keys=True
+    )
+    a = CompressedDictionary.load(os.path.join("tmp", "result"))
+
+    with pytest.raises(ValueError):
+        CompressedDictionary.combine_on_disk(os.path.join("tmp", "result"), *filepaths, reset_keys=False)
+
+    CompressedDictionary.combine_on_disk(
+        os.path.join("tmp", "result"), *filepaths, compression=compression, reset_keys=False, skip_duplicate_check=True
+    )
+    b = CompressedDictionary.load(os.path.join("tmp", "result"))
+    shutil.rmtree("tmp")
+
+    assert a.compression == (compression or 'bz2')
+    assert list(a.keys()) == list(range(40))
+    assert [a[k] for k in a] == [first[k] for k in first] + [second[k] for k in second]
+
+    # values of the second dictionary overwrite the ones of the first when loading
+    assert b.compression == a.compression
+    assert len(b) == 30
+    assert all(b[k] == (second[k] if k in second else first[k]) for k in b)
+
+
+# testing every compression algorithm
+@pytest.mark.parametrize(
+    ["compression"], [
+        [compression] for compression in CompressedDictionary.ALLOWED_COMPRESSIONS
+    ],
+)
+def test_compressions(compression):
+
+    dd = CompressedDictionary(compression=compression)
+    for i in range(10):
+        dd[i] = generate_dict()
+
+    dd.dump("tmp.cd")
+    a = CompressedDictionary.load('tmp.cd')
+    os.remove('tmp.cd')
+
+    assert a.compression == compression
+    assert a == dd
+    assert all(a[k] == dd[k] for k in dd)
+
+
+# testing gzip values are standard gzip streams
+def test_gzip():
+
+    values = [{'a': [1, 2.5, None]}, generate_string(), b'bytes' * 100, b'']
+
+    dd = CompressedDictionary(compression='gzip')
+    for i, value in enumerate(values):
+        dd[i] = value
+
+    assert all(dd[i] == value for i, value in enumerate(values))
+
+    # values compressed by the `gzip` module can be read and viceversa
+    assert gzip.decompress(dd._content[2]) == b'\x02' + values[2]
+    dd._content[4] = gzip.compress(b'\x01string')
+    assert dd[4] == 'string'
+
+
+# testing parallel assignment
+def test_bulk_set():
+
+    values = [generate_dict() for _ in range(100)]
+
+    dd = CompressedDictionary()
+    dd.bulk_set(enumerate(values), workers=2)
+
+    a = CompressedDictionary()
+    a.update(enumerate(values))
+
+    b = CompressedDictionary()
+    b.update_parallel(dict(enumerate(values)), workers=2)
+
+    assert a == dd
+    assert a == b
+
+
+def load_module_without(*modules):
+    r""" Import a separate copy of the `compressed_dictionary` module as if `modules` were not installed. """
+    with mock.patch.dict(sys.modules, {name: None for name in modules}):
+        spec = importlib.util.spec_from_file_location("compressed_dictionary_copy", compressed_dictionary.__file__)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    return module
+
+
+@dataclasses.dataclass
+class Point:
+    x: int
+
+
+class Color(enum.Enum):
+    RED = 1
+
+
+class Size(enum.IntEnum):
+    SMALL = 1
+
+
+# testing values that fast json libraries do not support, with every json library
+@pytest.mark.parametrize(
+    ["missing_modules"], [
+        [()], [('orjson', )], [('orjson', 'ujson')],
+    ],
+)
+def test_json_fallback(missing_modules):
+
+    CompressedDictionary = load_module_without(*missing_modules).CompressedDictionary
+
+    values = [2 ** 70, -2 ** 70, '\ud800', {'a': ['\udfff', 2 ** 64]}]
+
+    dd = CompressedDictionary()
+    for i, value in enumerate(values):
+        dd[i] = value
+
+    assert all(dd[i] == value for i, value in enumerate(values))
+
+    # values serialized by the standard library in older versions
+    dd._content[0] = bz2.compress(json.dumps([float('inf'), 2 ** 70]).encode('utf-8'))
+    assert dd[0] == [float('inf'), 2 ** 70]
+
+    dd._content[0] = bz2.compress(json.dumps(2 ** 70).encode('utf-8'))
+    assert dd[0] == 2 ** 70
+
+    dd._content[0] = bz2.compress(json.dumps({'a': 2 ** 70}).encode('utf-8'))
+    assert dd[0] == {'a': 2 ** 70}
+
+    # non-finite floats are not replaced by the fast serializers
+    dd[0] = float('nan')
+    assert math.isnan(dd[0])
+
+    dd[0] = [float('inf'), None, {'a': float('-inf')}]
+    assert dd[0] == [float('inf'), None, {'a': float('-inf')}]
+
+    # values are read back as the standard library would do
+    values = [{1e20: 1, 1: (2, 3)}, [Size.SMALL], {'a': OrderedDict(b=None)}]
+    for value in values:
+        dd[0] = value
+        assert dd[0] == json.loads(json.dumps(value))
+
+    # types not supported by the standard library are rejected
+    for value in (uuid.UUID(int=1), Point(1), Color.RED, datetime.date(2020, 1, 1), decimal.Decimal('1.5')):
+        with pytest.raises(TypeError):
+            dd[0] = value
+        with pytest.raises(TypeError):
+            dd[0] = {'a': [value]}
+
+
+# testing values containing None are not serialized again by the standard library
+@pytest.mark.skipif(orjson is None and ujson is None, reason="neither orjson nor ujson is installed")
+def test_json_none_values():
+
+    values = [None, [None] * 100, {'a': None, 'b': 'null', 'c': [1.5, None]}, {1: None, 'b': (None, 2.5)}]
+
+    dd = CompressedDictionary()
+    for i, value in enumerate(values):
+        dd[i] = value
+
+    assert all(dd[i] == json.loads(json.dumps(value)) for i, value in enumerate(values))
+    assert all(bz2.decompress(dd._content[i])[:1] == _JSON_TAG for i in range(len(values)))
+
+
+# testing values stored without json serialization
+def test_strings_and_bytes():
+
+    values = ['', generate_string(), '\ud800', b'', bytes(range(256)), bytearray(b'\x01\x02')]
+
+    dd = CompressedDictionary()
+    for i, value in enumerate(values):
+        dd[i] = value
+
+    assert all(dd[i] == value for i, value in enumerate(values))
+
+    # strings serialized as json by older versions
+    dd._content[0] = bz2.compress(json.dumps('"\x01"').encode('utf-8'))
+    assert dd[0] == '"\x01"'
+
+
+# testing merge with compressions other than the default one
+@pytest.mark.parametrize(
+    ["compression"], [
+        ['xz'], ['gzip'],
+    ],
+)
+def test_merge_compressions(compression):
+
+    first = CompressedDictionary(compression=compression)
+    first.update((i, generate_string()) for i in range(10))
+    second = CompressedDictionary(compression=compression)
+    second.update((i, generate_string()) for i in range(10, 20))
+
+    res = first.merge(second, reset_keys=True)
+    assert res.compression == compression
+    assert [res[k] for k in range(20)] == [first[k] for k in first] + [second[k] for k in second]
+
+    res = first.merge(second, reset_keys=False)
+    assert res.compression == compression
+    assert all(res[k] == (first[k] if k in first else second[k]) for k in range(20))
+
+
+# testing in-place merge filling holes in the keys
+def test_merge_in_place():
+
+    other = CompressedDictionary()
+    other.update((i, f"other-{i}") for i in range(4))
+
+    # after deleting the largest key, the only hole is 1 and the following values go after key 2
+    dd = CompressedDictionary()
+    dd.update((i, f"self-{i}") for i in (0, 2, 5))
+    del dd[5]
+
+    dd.merge_(other, reset_keys=True)
+    assert set(dd.keys()) == set(range(6))
+    assert [dd[k] for k in range(6)] == ["self-0", "other-0", "self-2", "other-1", "other-2", "other-3"]
+
+    # holes left by deleted keys are filled first, in ascending order
+    del dd[1]
+    del dd[3]
+    dd.merge_(other, reset_keys=True)
+    assert set(dd.keys()) == set(range(8))
+    assert [dd[k] for k in (1, 3, 6, 7)] == ["other-0", "other-1", "other-2", "other-3"]
+
+    # merging into an empty dictionary
+    empty = CompressedDictionary()
+    empty.merge_(other, reset_keys=True)
+    assert set(empty.keys()) == set(range(4))
+    assert all(empty[k] == other[k] for k in other)
+
+    # keys are kept as they are without reset
+    dd = CompressedDictionary()
+    dd.update((i, f"self-{i}") for i in (10, 20))
+    dd.merge_(other, reset_keys=False)
+    assert set(dd.keys()) == {0, 1, 2, 3, 10, 20}
+
+    with pytest.raises(ValueError):
+        dd.merge_(other, reset_keys=False)
+
+
+# testing the set of keys used to detect duplicates
+def test_keys_set():
+
+    keys = _KeysSet(max_bitmap_key=64)
+    inserted = [0, 7, 8, 63, -1, -100, 64, 1000]
+    for key in inserted:
+        assert key not in keys
+        keys.add(key)
+        assert key in keys
+
+    # duplicates in both the bitmap and the set
+    for key in (7, -1, 64):
+        keys.add(key)
+        assert key in keys
+
+    assert all(key in keys for key in inserted)
+    assert all(key not in keys for key in (1, 62, -2, 65, 999))
+    assert keys._others == {-1, -100, 64, 1000}
+
+
+# testing values of different types in the same dictionary
+def test_mixed_types():
+
+    values = [generate_dict(), generate_list(), generate_string(), b'bytes', 1, None, 2.5]
+
+    dd = CompressedDictionary()
+    for i, value in enumerate(values):
+        dd[i] = value
+
+    reference = [json.loads(json.dumps(value)) if not isinstance(value, bytes) else value for value in values]
+    assert all(dd[i] == value for i, value in enumerate(reference))
+
+    a = pickle.loads(pickle.dumps(dd))
+    assert a == dd
+
+
+# testing pickling with every compression algorithm
+@pytest.mark.parametrize(
+    ["compression"], [
+        [compression] for compression in CompressedDictionary.ALLOWED_COMPRESSIONS
+    ],
+)
+def test_pickle(compression):
+
+    dd = CompressedDictionary(compression=compression)
+    dd.update((i, generate_dict()) for i in range(100))
+    if compression == 'zstd':
+        dd.train_dictionary(dict_size=1024)
+
+    a = pickle.loads(pickle.dumps(dd))
+    assert a.compression == compression
+    assert a.compression_dictionary == dd.compression_dictionary
+    assert a == dd
+
+    # compression works in the unpickled dictionary as well
+    value = generate_list()
+    a[100] = value
+    assert a[100] == json.loads(json.dumps(value))
+
+
+# testing zstd trained dictionaries
+@pytest.mark.skipif('zstd' not in CompressedDictionary.ALLOWED_COMPRESSIONS, reason="zstandard is not installed")
+def test_train_dictionary():
+
+    dd = CompressedDictionary(compression='zstd')
+    dd.update((i, {'index': i, 'value': generate_string()}) for i in range(1000))
+
+    a = CompressedDictionary(compression='zstd')
+    a.update(dd)
+
+    dd.train_dictionary(dict_size=4096)
+    assert dd.compression_dictionary is not None
+    assert dd == a
+
+    dd.dump("tmp.cd")
+    b = CompressedDictionary.load("tmp.cd")
+    os.remove("tmp.cd")
+
+    assert b.compression_dictionary == dd.compression_dictionary
+    assert b == a
+
+
+# testing msgpack serialization
+@pytest.mark.skipif('msgpack' not in CompressedDictionary.ALLOWED_SERIALIZATIONS, reason="msgpack is not installed")
+def test_msgpack_serialization():
+
+    dd = CompressedDictionary(serialization='msgpack')
+    values = [{1: b'bytes', 'a': [1, 2.5, None]}, [True, 'string'], 'string', b'bytes', 2 ** 70]
+    for i, value in enumerate(values):
+        dd[i] = value
+
+    for i, value in enumerate(values):
+        assert dd[i] == value
+
+    dd.dump("tmp.cd")
+    a = CompressedDictionary.load("tmp.cd")
+    os.remove("tmp.cd")
+
+    assert a.serialization == 'msgpack'
+    assert a == dd
+
+    # values are decoded whatever the serialization of the dictionary containing them
+    b = CompressedDictionary()
+    b.update(dd)
+    assert b == dd